@@ -7,6 +7,7 @@ from mytorch.core import no_grad
 from mytorch.core import as_array
 from mytorch.core import as_variable
 from mytorch.core import Config
+from mytorch.core import checkpoint
 
 from mytorch.layers import Layer
 from mytorch.models import Model
@@ -0,0 +1,117 @@
+import math
+import numpy as np
+from mytorch import cuda
+
+numba_available = True
+try:
+    from numba import njit, prange
+except ImportError:
+    numba_available = False
+
+numexpr_available = True
+try:
+    import numexpr as ne
+except ImportError:
+    numexpr_available = False
+
+scipy_available = True
+try:
+    from scipy.special import expit
+except ImportError:
+    scipy_available = False
+
+
+# Below this size the thread start-up of a parallel loop costs more than
+# the NumPy ufuncs it replaces.
+min_size = 1 << 14
+
+
+def available(x):
+    """Return True if `x` can be handed to the compiled kernels."""
+    return (
+        numba_available
+        and isinstance(x, np.ndarray)
+        and x.size >= min_size
+        and x.dtype in (np.float32, np.float64)
+        and x.flags.c_contiguous
+    )
+
+
+if numba_available:
+
+    @njit(parallel=True)
+    def _sigmoid_fwd(x, y):
+        for i in prange(x.size):
+            y[i] = 1.0 / (1.0 + math.exp(-x[i]))
+
+    @njit(parallel=True)
+    def _tanh_fwd(x, y):
+        for i in prange(x.size):
+            y[i] = math.tanh(x[i])
+
+    @njit(parallel=True)
+    def _relu_fwd(x, y, mask):
+        for i in prange(x.size):
+            mask[i] = x[i] > 0
+            y[i] = 0 if x[i] <= 0 else x[i]  # NaN passes through like np.maximum
+
+
+def sigmoid_fwd(x):
+    y = np.empty_like(x)
+    _sigmoid_fwd(x.ravel(), y.ravel())
+    return y
+
+
+def expit_available(x):
+    """Return True if `x` can be handed to scipy.special.expit."""
+    return scipy_available and isinstance(x, np.ndarray) and x.dtype.kind == "f"
+
+
+def sigmoid_expit(x):
+    y = np.empty_like(x)
+    expit(x, out=y)  # one ufunc pass, no overflow for large negative x
+    return y
+
+
+def tanh_fwd(x):
+    y = np.empty_like(x)
+    _tanh_fwd(x.ravel(), y.ravel())
+    return y
+
+
+def relu_fwd(x):
+    y = np.empty_like(x)
+    mask = np.empty(x.shape, dtype=bool)
+    _relu_fwd(x.ravel(), y.ravel(), mask.ravel())
+    return y, mask
+
+
+"""
+Backward of activations on raw arrays (used when no graph is created)
+"""
+
+
+def _use_numexpr(*xs):
+    return numexpr_available and all(
+        isinstance(x, np.ndarray) and x.size >= min_size for x in xs
+    )
+
+
+def sigmoid_bwd(y, dy):
+    if _use_numexpr(y, dy):
+        # integer constant keeps float32 inputs in float32
+        return ne.evaluate("dy * y * (1 - y)")
+    xp = cuda.get_array_module(y)
+    dx = xp.asarray(dy * y)  # 0-d inputs give a scalar here
+    dx *= 1 - y
+    return dx
+
+
+def tanh_bwd(y, dy):
+    if _use_numexpr(y, dy):
+        return ne.evaluate("dy * (1 - y * y)")
+    xp = cuda.get_array_module(y)
+    dx = xp.asarray(dy * y)  # 0-d inputs give a scalar here
+    dx *= y
+    xp.subtract(dy, dx, out=dx)
+    return dx
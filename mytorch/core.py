@@ -1,4 +1,6 @@
 import numpy as np
+import heapq
+import threading
 import weakref
 from contextlib import contextmanager
 import mytorch
@@ -20,6 +22,13 @@ class Variable:
         if (data is not None) and (not isinstance(data, array_types)):
             raise TypeError(f"{type(data)} is not supported")
 
+        # floating point data is kept in Config.default_dtype (None : keep as is),
+        # Parameters keep the dtype their layer asked for
+        if data is not None and not isinstance(self, Parameter):
+            dtype = Config.default_dtype
+            if dtype is not None and data.dtype != dtype and data.dtype.kind == "f":
+                data = data.astype(dtype)
+
         self.name = name
         self.data = data
         self.grad = None
@@ -122,46 +131,103 @@ class Variable:
         if self.data is not None:
             self.data = mytorch.cuda.as_cupy(self.data)
 
-    def backward(self, retain_grad=False, create_graph=False):
+    def backward(self, retain_grad=False, create_graph=False, retain_graph=False):
         if self.grad is None:
             xp = mytorch.cuda.get_array_module(self.data)
-            self.grad = Variable(xp.ones_like(self.data))
-
-        funcs = []
-        seen_set = set()
-
-        def add_func(f):
-            if f not in seen_set:
-                seen_set.add(f)  # for avoiding duplication of functions
-                funcs.append(f)
-                funcs.sort(key=lambda x: x.generation)
-
-        add_func(self.creator)  # sort functions by generation
-
-        while funcs:
-            func = funcs.pop()
+            one = xp.array(1, dtype=self.data.dtype)
+            # read-only view of a single 1, no full-size array is allocated
+            self.grad = _wrap(xp.broadcast_to(one, self.data.shape))
+
+        if self.creator is None:
+            return
+
+        # Functions are taped in creation order, so walking the tape backwards
+        # visits every function after all functions that use its outputs.
+        funcs = _tape.funcs
+        mark = object()  # marks functions reachable from self in this call
+        done = object()  # marks functions already processed in this call
+        self.creator._mark = mark
+        reached = [self.creator]
+        free_graph = not (retain_graph or create_graph)
+
+        def step(func):
+            outputs = func.outputs
+            strong = not isinstance(outputs[0], weakref.ref)
+            if not strong:
+                outputs = [y() for y in outputs]  # dereference weakrefs once
 
             # backpropagation
-            dys = [y().grad for y in func.outputs]
-
-            with using_config("enable_backprop", create_graph):
-                dxs = func.backward(*dys)
+            dxs = func.backward(*[y.grad for y in outputs])
 
-                if not isinstance(dxs, tuple):
-                    dxs = (dxs,)
+            if not isinstance(dxs, tuple):
+                dxs = (dxs,)
 
-                for x, dx in zip(func.inputs, dxs):
-                    if x.grad is None:
-                        x.grad = dx
-                    else:
-                        x.grad = x.grad + dx  # Add gradient if x.grad already exists.
+            for x, dx in zip(func.inputs, dxs):
+                if x.grad is None:
+                    x.grad = dx
+                else:
+                    x.grad = x.grad + dx  # Add gradient if x.grad already exists.
 
-                    if x.creator:
-                        add_func(x.creator)
+                creator = x.creator
+                if creator is not None and creator._mark is not mark:
+                    if creator._mark is not done:
+                        creator._mark = mark
+                        reached.append(creator)
 
             if not retain_grad:
-                for y in func.outputs:
-                    y().grad = None
+                for y in outputs:
+                    y.grad = None
+
+            # break the output <-> creator reference cycle
+            if strong and free_graph:
+                func.inputs = func.outputs = None
+            func._mark = done
+
+        with using_config("enable_backprop", create_graph):
+            processed = 0
+            for i in range(len(funcs) - 1, -1, -1):
+                func = funcs[i]()
+                if func is None or func._mark is not mark:
+                    continue
+                step(func)
+                processed += 1
+                if processed == len(reached):
+                    break
+
+            if processed < len(reached):
+                # some reached functions are not on the tape, walk them by generation
+                _walk_generations(
+                    [f for f in reached if f._mark is mark], reached, step
+                )
+
+        if free_graph:
+            _prune_tape()
+
+
+def _walk_generations(funcs, reached, step):
+    # creator walk for functions the tape scan missed; step() appends the
+    # creators it reaches to `reached`
+    heap = [(-f.generation, id(f), f) for f in funcs]
+    heapq.heapify(heap)
+    n = len(reached)
+    while heap:
+        func = heapq.heappop(heap)[2]
+        if func.inputs is None:  # dropped from the tape by a previous backward
+            raise RuntimeError(
+                "graph was freed by a previous backward, "
+                "use backward(retain_graph=True) to keep it"
+            )
+        step(func)
+        for f in reached[n:]:
+            heapq.heappush(heap, (-f.generation, id(f), f))
+        n = len(reached)
+
+
+def _wrap(data):
+    # Variable for data computed inside the library, its dtype is kept as is
+    v = Variable(None)
+    v.data = data
+    return v
 
 
 def as_variable(obj):
@@ -191,28 +257,80 @@ Function : Base class of functions
 """
 
 
+class _Tape:
+    # weak references to the Functions recorded by all threads, in creation order;
+    # shared so that backward() can run in a different thread than the forward
+    def __init__(self):
+        self.funcs = []
+        self.limit = 1024
+        self.lock = threading.Lock()
+
+
+_tape = _Tape()
+
+
+def _prune_tape():
+    # drop functions that were garbage collected or freed by backward
+    with _tape.lock:
+        funcs = []
+        for ref in _tape.funcs:
+            f = ref()
+            if f is not None and f.inputs is not None:
+                funcs.append(ref)
+        _tape.funcs = funcs  # rebind, a running backward keeps iterating the old list
+        _tape.limit = max(1024, 2 * len(funcs))
+
+
 class Function:
+    inputs = None
+    _mark = None  # set by Variable.backward on reachable functions
+
     def __call__(self, *inputs):
-        inputs = [as_variable(x) for x in inputs]
+        # convert inputs, collect their data and generation in one pass
+        variables, xs = [], []
+        max_gen = 0
+        for x in inputs:
+            if not isinstance(x, Variable):
+                x = Variable(x)
+            variables.append(x)
+            xs.append(x.data)
+            if x.generation > max_gen:
+                max_gen = x.generation
+        return self._call_fast(variables, xs, max_gen)
+
+    def _call_fast(self, inputs, xs, generation):
+        # inputs are already Variables and xs is their data
 
         # forwardpropagation
-        xs = [x.data for x in inputs]
         ys = self.forward(*xs)
         if not isinstance(ys, tuple):
             ys = (ys,)
-        outputs = [Variable(as_array(y)) for y in ys]
+        outputs = [_wrap(y if isinstance(y, array_types) else as_array(y)) for y in ys]
 
         if Config.enable_backprop:
-            self.generation = max([x.generation for x in inputs])
+            self.generation = generation
 
             # reference to the creator, inputs, and outputs
             for output in outputs:
                 output.set_creator(self)
             self.inputs = inputs
-            self.outputs = [weakref.ref(output) for output in outputs]
+            if Config.strong_outputs:
+                self.outputs = outputs
+            else:
+                self.outputs = [weakref.ref(output) for output in outputs]
+
+            with _tape.lock:
+                funcs = _tape.funcs
+                funcs.append(weakref.ref(self))
+            if len(funcs) > _tape.limit:
+                _prune_tape()
 
         return outputs if len(outputs) > 1 else outputs[0]
 
+    def output(self, i=0):
+        y = self.outputs[i]
+        return y() if isinstance(y, weakref.ref) else y
+
     def forward(self, *xs):
         raise NotImplementedError()
 
@@ -220,6 +338,12 @@ class Function:
         raise NotImplementedError()
 
 
+def _call_binary(f, x0, x1):
+    # fast path for operators whose operands are both Variables
+    g0, g1 = x0.generation, x1.generation
+    return f._call_fast((x0, x1), (x0.data, x1.data), g0 if g0 > g1 else g1)
+
+
 """
 Config
 """
@@ -228,6 +352,11 @@ Config
 class Config:
     enable_backprop = True
     train = True
+    # Functions hold their outputs directly instead of weakrefs (opt-in).
+    # This makes a reference cycle that only backward breaks, so a graph
+    # that is never backpropagated waits for the cyclic GC.
+    strong_outputs = False
+    default_dtype = np.float32
 
 
 @contextmanager
@@ -261,14 +390,17 @@ class Add(Function):
 
     def backward(self, dy):
         dx0, dx1 = dy, dy
-        if self.x0_shape != self.x1_shape:
-            dx0 = mytorch.utils.sum_to(dx0, self.x0_shape)
-            dx1 = mytorch.utils.sum_to(dx1, self.x1_shape)
+        if dx0.shape != self.x0_shape:
+            dx0 = mytorch.functions.sum_to(dx0, self.x0_shape)
+        if dx1.shape != self.x1_shape:
+            dx1 = mytorch.functions.sum_to(dx1, self.x1_shape)
         return dx0, dx1
 
 
 def add(x0, x1):
-    x1 = as_array(x1, mytorch.cuda.get_array_module(x0.data))
+    if isinstance(x1, Variable):
+        return _call_binary(Add(), x0, x1)
+    x1 = as_array(x1, mytorch.cuda.get_array_module(x0))
     return Add()(x0, x1)
 
 
@@ -281,14 +413,17 @@ class Mul(Function):
         x0, x1 = self.inputs
         dx0 = dy * x1
         dx1 = dy * x0
-        if x0.shape != x1.shape:
-            dx0 = mytorch.utils.sum_to(dx0, x0.shape)
-            dx1 = mytorch.utils.sum_to(dx1, x1.shape)
+        if dx0.shape != x0.shape:
+            dx0 = mytorch.functions.sum_to(dx0, x0.shape)
+        if dx1.shape != x1.shape:
+            dx1 = mytorch.functions.sum_to(dx1, x1.shape)
         return dx0, dx1
 
 
 def mul(x0, x1):
-    x1 = as_array(x1, mytorch.cuda.get_array_module(x0.data))
+    if isinstance(x1, Variable):
+        return _call_binary(Mul(), x0, x1)
+    x1 = as_array(x1, mytorch.cuda.get_array_module(x0))
     return Mul()(x0, x1)
 
 
@@ -313,16 +448,18 @@ class Sub(Function):
 
     def backward(self, dy):
         dx0, dx1 = dy, -dy
-        if self.x0_shape != self.x1_shape:
-            dx0 = mytorch.utils.sum_to(dx0, self.x0_shape)
-            dx1 = mytorch.utils.sum_to(dx1, self.x1_shape)
+        if dx0.shape != self.x0_shape:
+            dx0 = mytorch.functions.sum_to(dx0, self.x0_shape)
+        if dx1.shape != self.x1_shape:
+            dx1 = mytorch.functions.sum_to(dx1, self.x1_shape)
         return dx0, dx1
 
 
 def sub(x0, x1):
-    x0 = as_array(x0, mytorch.cuda.get_array_module(x1.data))
-    x1 = as_array(x1, mytorch.cuda.get_array_module(x0.data))
-    return Sub()(x0, x1)
+    if isinstance(x0, Variable) and isinstance(x1, Variable):
+        return _call_binary(Sub(), x0, x1)
+    xp = mytorch.cuda.get_array_module(x0 if isinstance(x0, Variable) else x1)
+    return Sub()(as_array(x0, xp), as_array(x1, xp))
 
 
 class Div(Function):
@@ -334,15 +471,18 @@ class Div(Function):
         x0, x1 = self.inputs
         dx0 = dy / x1
         dx1 = -dy * (x0 / x1**2)
-        if x0.shape != x1.shape:
-            dx0 = mytorch.utils.sum_to(dx0, x0.shape)
-            dx1 = mytorch.utils.sum_to(dx1, x1.shape)
+        if dx0.shape != x0.shape:
+            dx0 = mytorch.functions.sum_to(dx0, x0.shape)
+        if dx1.shape != x1.shape:
+            dx1 = mytorch.functions.sum_to(dx1, x1.shape)
         return dx0, dx1
 
 
 def div(x0, x1):
-    x0, x1 = as_array(x0), as_array(x1)
-    return Div()(x0, x1)
+    if isinstance(x0, Variable) and isinstance(x1, Variable):
+        return _call_binary(Div(), x0, x1)
+    xp = mytorch.cuda.get_array_module(x0 if isinstance(x0, Variable) else x1)
+    return Div()(as_array(x0, xp), as_array(x1, xp))
 
 
 class Pow(Function):
@@ -350,12 +490,20 @@ class Pow(Function):
         self.c = c
 
     def forward(self, x):
-        y = x**self.c
+        c = self.c
+        if isinstance(c, (int, np.integer)) and 2 <= c <= 8:
+            y = x * x  # small integer powers by repeated multiplication
+            for _ in range(c - 2):
+                y *= x
+            return y
+        y = x**c
         return y
 
     def backward(self, dy):
         (x,) = self.inputs
         c = self.c
+        if c == 2:
+            return 2 * x * dy
         dx = c * x ** (c - 1) * dy
         return dx
 
@@ -366,7 +514,7 @@ def pow(x, c):
 
 class Square(Function):
     def forward(self, x):
-        y = x**2
+        y = x * x
         return y
 
     def backward(self, dy):
@@ -378,3 +526,54 @@ class Square(Function):
 def square(x):
     x = as_array(x, mytorch.cuda.get_array_module(x.data))
     return Square()(x)
+
+
+"""
+Checkpoint : Recompute a subgraph during backward instead of storing it
+"""
+
+
+class Checkpoint(Function):
+    def __init__(self, fn):
+        self.fn = fn
+
+    def forward(self, *xs):
+        # only the inputs are kept, intermediate results of fn are discarded
+        with no_grad():
+            ys = self.fn(*[_wrap(x) for x in xs])
+        if not isinstance(ys, tuple):
+            ys = (ys,)
+        return tuple(y.data for y in ys) if len(ys) > 1 else ys[0].data
+
+    def backward(self, *dys):
+        create_graph = Config.enable_backprop
+
+        # rerun fn on fresh Variables to rebuild its graph
+        # (detached from the inputs, so no higher-order gradients through fn)
+        xs = [_wrap(x.data) for x in self.inputs]
+        with using_config("enable_backprop", True):
+            ys = self.fn(*xs)
+        if not isinstance(ys, tuple):
+            ys = (ys,)
+
+        if len(ys) == 1:
+            y = ys[0]
+            y.grad = dys[0]
+        else:
+            # reduce to a scalar whose gradient w.r.t. each y_i is dy_i
+            with using_config("enable_backprop", True):
+                y = sum((y_i * dy).sum() for y_i, dy in zip(ys, dys) if dy is not None)
+        y.backward(create_graph=create_graph)
+
+        dxs = []
+        for x in xs:
+            if x.grad is None:
+                xp = mytorch.cuda.get_array_module(x.data)
+                x.grad = _wrap(xp.zeros_like(x.data))
+            dxs.append(x.grad)
+        return tuple(dxs) if len(dxs) > 1 else dxs[0]
+
+
+def checkpoint(fn, *args):
+    # fn must be deterministic (ex : no dropout), since it is run again in backward
+    return Checkpoint(fn)(*args)
@@ -1,7 +1,7 @@
 import numpy as np
 import mytorch
-from mytorch.core import Variable, Function, as_array, as_variable
-from mytorch import cuda, utils
+from mytorch.core import Variable, Function, as_array, as_variable, _wrap
+from mytorch import cuda, utils, _kernels
 
 
 """
@@ -16,7 +16,7 @@ class Exp(Function):
         return y
 
     def backward(self, dy):
-        y = self.outputs[0]()
+        y = self.output()
         dx = y * dy
         return dx
 
@@ -65,12 +65,16 @@ Activation functions
 
 class Tanh(Function):
     def forward(self, x):
+        if _kernels.available(x):
+            return _kernels.tanh_fwd(x)
         xp = cuda.get_array_module(x)
         y = xp.tanh(x)
         return y
 
     def backward(self, dy):
-        y = self.outputs[0]()
+        y = self.output()
+        if not mytorch.Config.enable_backprop:  # no graph needed, fuse on arrays
+            return _wrap(_kernels.tanh_bwd(y.data, dy.data))
         dx = dy * (1 - y**2)
         return dx
 
@@ -81,12 +85,18 @@ def tanh(x):
 
 class Sigmoid(Function):
     def forward(self, x):
+        if _kernels.available(x):
+            return _kernels.sigmoid_fwd(x)
+        if _kernels.expit_available(x):
+            return _kernels.sigmoid_expit(x)
         xp = cuda.get_array_module(x)
         y = 1 / (1 + xp.exp(-x))
         return y
 
     def backward(self, dy):
-        y = self.outputs[0]()
+        y = self.output()
+        if not mytorch.Config.enable_backprop:  # no graph needed, fuse on arrays
+            return _wrap(_kernels.sigmoid_bwd(y.data, dy.data))
         dx = dy * y * (1 - y)
         return dx
 
@@ -96,14 +106,34 @@ def sigmoid(x):
 
 
 class ReLU(Function):
+    # masks with at least this many elements (1MB as bool) are bit-packed
+    pack_threshold = 1 << 20
+
     def forward(self, x):
         xp = cuda.get_array_module(x)
-        y = xp.maximum(0, x)
+        if _kernels.available(x):
+            y, mask = _kernels.relu_fwd(x)
+        else:
+            mask = x > 0
+            y = xp.empty_like(x)
+            xp.maximum(x, 0, out=y)
+
+        # keep the mask for backward, 8 elements per byte if it is large
+        if mask.size >= self.pack_threshold:
+            self.mask = None
+            self.mask_packed = xp.packbits(mask.ravel())
+            self.mask_shape = mask.shape
+        else:
+            self.mask = mask
         return y
 
     def backward(self, dy):
-        (x,) = self.inputs
-        mask = (x.data > 0).astype(float)
+        mask = self.mask
+        if mask is None:
+            xp = cuda.get_array_module(self.mask_packed)
+            size = dy.size
+            mask = xp.unpackbits(self.mask_packed)[:size].view(bool)
+            mask = mask.reshape(self.mask_shape)
         dx = dy * mask
         return dx
 
@@ -119,12 +149,14 @@ class Softmax(Function):
     def forward(self, x):
         xp = cuda.get_array_module(x)
         x_max = xp.max(x, axis=self.axis, keepdims=True)
-        exp_x = xp.exp(x - x_max)
-        y = exp_x / xp.sum(exp_x, axis=self.axis, keepdims=True)
+        y = xp.empty(x.shape, dtype=xp.result_type(x.dtype, xp.float32))
+        xp.subtract(x, x_max, out=y)
+        xp.exp(y, out=y)
+        y /= xp.sum(y, axis=self.axis, keepdims=True)
         return y
 
     def backward(self, dy):
-        y = self.outputs[0]()
+        y = self.output()
         dx = y * (dy - sum(y * dy, axis=self.axis, keepdims=True))
 
         return dx
@@ -175,6 +207,8 @@ class Transpose(Function):
 
 
 def transpose(x, axes=None):
+    if x.ndim < 2 and axes in (None, (), (0,)):
+        return x if isinstance(x, Variable) else Variable(x)  # No need to transpose
     return Transpose(axes)(x)
 
 
@@ -231,7 +265,7 @@ class GetItemGrad(Function):
 
     def forward(self, dy):
         xp = cuda.get_array_module(dy)
-        dx = xp.zeros(self.in_shape)
+        dx = xp.zeros(self.in_shape, dtype=dy.dtype)
 
         if xp is np:
             np.add.at(dx, self.slices, dy)
@@ -315,6 +349,11 @@ class Matmul(Function):
 
     def backward(self, dy):
         x, W = self.inputs
+        if not mytorch.Config.enable_backprop:  # no graph needed, call BLAS directly
+            xp = cuda.get_array_module(dy)
+            dx = _wrap(xp.dot(dy.data, W.data.T))
+            dW = _wrap(xp.dot(x.data.T, dy.data))
+            return dx, dW
         dx = matmul(dy, W.T)
         dW = matmul(x.T, dy)
         return dx, dW
@@ -331,11 +370,18 @@ Loss functions: MSE, BCE(Binary Crossentropy), CCE(Categorical Crossentropy)
 
 class MSE(Function):
     def forward(self, y, y_hat):
+        xp = cuda.get_array_module(y)
         diff = y - y_hat
-        j = (diff**2).sum() / diff.shape[0]
+        self.diff = diff  # reused in backward
+        flat = diff.ravel()
+        j = xp.dot(flat, flat) / diff.shape[0]  # sum of squares in one pass
+        j = j.astype(diff.dtype)  # scalar / int gives float64
         return j
 
     def backward(self, dj):
+        if not mytorch.Config.enable_backprop:  # no graph needed, reuse the error
+            dy = self.diff * (dj.data * (2 / self.diff.shape[0]))
+            return _wrap(dy), _wrap(-dy)
         y, y_hat = self.inputs
         dy = dj * 2 * (y - y_hat) / y.shape[0]
         dy_hat = -dy
@@ -360,6 +406,7 @@ class CrossEntropyLoss(Function):
         log_p = xp.log(p + 1e-7)
         log_p = log_p[xp.arange(N), t.ravel()]
         j = -xp.sum(log_p) / N
+        j = j.astype(log_p.dtype)  # scalar / int gives float64
         return j
 
     def backward(self, dj):
@@ -369,7 +416,7 @@ class CrossEntropyLoss(Function):
         p = softmax(l)
 
         xp = cuda.get_array_module(t.data)
-        t_onehot = xp.eye(K, dtype=t.dtype)[t.data]  # convert to one-hot
+        t_onehot = xp.eye(K, dtype=p.dtype)[t.data]  # convert to one-hot
         dl = (p - t_onehot) * dj / N
         return dl
 
@@ -384,14 +431,30 @@ Layers
 
 
 class Linear(Function):
+    def __init__(self, out=None):
+        self.out = out  # optional output buffer, reused if shape and dtype match
+
     def forward(self, x, W, b):
-        y = x.dot(W)
+        xp = cuda.get_array_module(x)
+        shape = x.shape[:-1] + W.shape[1:]
+        dtype = xp.result_type(x, W)
+        y = self.out
+        if y is None or y.shape != shape or y.dtype != dtype:
+            y = xp.empty(shape, dtype=dtype)
+        xp.matmul(x, W, out=y)
         if b is not None:
-            y += b
+            xp.add(y, b, out=y)
         return y
 
     def backward(self, dy):
         x, W, b = self.inputs
+        if not mytorch.Config.enable_backprop:  # no graph needed, call BLAS directly
+            xp = cuda.get_array_module(dy)
+            dx = _wrap(xp.dot(dy.data, W.data.T))
+            dW = _wrap(xp.dot(x.data.T, dy.data))
+            db = None if b.data is None else _wrap(dy.data.sum(axis=0))
+            return dx, dW, db
+
         dx = matmul(dy, W.T)
         dW = matmul(x.T, dy)
         if b.data is None:
@@ -402,8 +465,8 @@ class Linear(Function):
         return dx, dW, db
 
 
-def linear(x, W, b):
-    return Linear()(x, W, b)
+def linear(x, W, b, out=None):
+    return Linear(out)(x, W, b)
 
 
 class Dropout(Function):
@@ -422,8 +485,8 @@ class Dropout(Function):
 
     def backward(self, dy):
         if mytorch.Config.train:
-            y = self.outputs[0]()
-            mask = (y.data != 0).astype(float)
+            y = self.output()
+            mask = (y.data != 0).astype(y.dtype)
             scale = 1 - self.dropout_ratio
             dx = dy * mask / scale
             return dx
@@ -48,12 +48,19 @@ class Layer:
 
 
 class Linear(Layer):
-    def __init__(self, out_size, no_bias=False, dtype=np.float32, in_size=None):
+    def __init__(
+        self, out_size, no_bias=False, dtype=np.float32, in_size=None, reuse_out=False
+    ):
         super().__init__()
         self.in_size = in_size
         self.out_size = out_size
         self.dtype = dtype
 
+        # If True, every forward writes into the same output array,
+        # so the output of the previous call is overwritten.
+        self.reuse_out = reuse_out
+        self._out = None
+
         self.W = Parameter(None, name="W")
         if self.in_size is not None:
             self._init_W()
@@ -75,6 +82,10 @@ class Linear(Layer):
             xp = cuda.get_array_module(x)
             self._init_W(xp)
 
-        y = F.linear(x, self.W, self.b)
+        if self.reuse_out:
+            y = F.linear(x, self.W, self.b, out=self._out)
+            self._out = y.data
+        else:
+            y = F.linear(x, self.W, self.b)
 
         return y
@@ -1,18 +1,40 @@
+import math
 import numpy as np
 from mytorch import cuda
+from mytorch.core import Parameter, _wrap
 
 
 class Optimizer:
     def __init__(self):
         self.target = None
         self.hooks = []  # preprocessing functions (ex : weight decay, ...)
+        self.flat = False
+        self.flat_param = None  # single Parameter viewing all params in flat mode
+        self._data_views, self._grad_views = [], []
 
     # Set model or layer as target
-    def setup(self, target):
+    # flat=True : keep all params in one contiguous array and update it at once
+    def setup(self, target, flat=False):
         self.target = target
+        self.flat = flat
+        if not flat:
+            for param in target.params():
+                if param.data is not None:  # lazily initialized params are skipped
+                    self.init_state(param)
         return self
 
+    # Allocate per-parameter state (ex : velocity, moments, ...)
+    def init_state(self, param):
+        pass
+
+    # Release per-parameter state
+    def drop_state(self, param):
+        pass
+
     def update(self):
+        if self.flat:
+            return self._update_flat()
+
         params = [p for p in self.target.params() if p.grad is not None]
 
         for f in self.hooks:
@@ -21,6 +43,58 @@ class Optimizer:
         for param in params:
             self.step(param)
 
+    def _update_flat(self):
+        # lazily initialized params are left out until they get data
+        params = {id(p): p for p in self.target.params() if p.data is not None}
+        params = list(params.values())
+        views = self._data_views
+        if (
+            self.flat_param is None
+            or len(params) != len(views)
+            or any(p.data is not v for p, v in zip(params, views))
+        ):
+            self._flatten(params)  # first update, or params were replaced
+
+        for f in self.hooks:
+            f([p for p in params if p.grad is not None])
+
+        # gather gradients, params without one get a zero gradient
+        for param, g in zip(params, self._grad_views):
+            if param.grad is None:
+                g[...] = 0
+            else:
+                g[...] = param.grad.data
+
+        self.step(self.flat_param)
+
+    def _flatten(self, params):
+        dtypes = {p.data.dtype for p in params}
+        if len(dtypes) > 1:
+            raise TypeError(f"flat update needs one dtype, got {dtypes}")
+
+        xp = cuda.get_array_module(params[0].data)
+        size = sum(p.data.size for p in params)
+        flat_data = xp.empty(size, dtype=dtypes.pop())
+        flat_grad = xp.empty_like(flat_data)
+
+        views, grad_views = [], []
+        offset = 0
+        for param in params:
+            n = param.data.size
+            view = flat_data[offset : offset + n].reshape(param.data.shape)
+            view[...] = param.data
+            param.data = view  # params now share the flat array
+            views.append(view)
+            grad_views.append(flat_grad[offset : offset + n].reshape(view.shape))
+            offset += n
+
+        if self.flat_param is not None:
+            self.drop_state(self.flat_param)
+        self.flat_param = Parameter(flat_data, name="flat")
+        self.flat_param.grad = _wrap(flat_grad)
+        self._data_views, self._grad_views = views, grad_views
+        self.init_state(self.flat_param)
+
     def step(self, param):
         raise NotImplementedError
 
@@ -44,14 +118,22 @@ class MomentumSGD(Optimizer):
         self.momentum = momentum
         self.vs = {}
 
-    def step(self, param):
-        v_key = id(param)
-        if v_key not in self.vs:
-            xp = cuda.get_array_module(param.data)
-            self.vs[v_key] = xp.zeros_like(param.data)
+    def init_state(self, param):
+        xp = cuda.get_array_module(param.data)
+        self.vs[id(param)] = xp.zeros_like(param.data)
+
+    def drop_state(self, param):
+        self.vs.pop(id(param), None)
 
-        v = self.vs[v_key]
-        v = self.momentum * v - self.lr * param.grad.data
+    def step(self, param):
+        try:
+            v = self.vs[id(param)]
+        except KeyError:  # param was initialized after setup()
+            self.init_state(param)
+            v = self.vs[id(param)]
+
+        v *= self.momentum
+        v -= self.lr * param.grad.data
         param.data += v
 
 
@@ -96,33 +178,62 @@ class RMSProp:
             params[key] -= (self.lr / np.sqrt(self.h[key]) + 1e-7) * grads[key]
 
 
-class Adam:
-    def __init__(self, lr, beta1=0.9, beta2=0.999, weight_decay=0):
+class Adam(Optimizer):
+    def __init__(self, lr=0.001, beta1=0.9, beta2=0.999, eps=1e-8, weight_decay=0):
+        super().__init__()
         self.lr = lr
         self.beta1 = beta1
         self.beta2 = beta2
+        self.eps = eps
         self.decay = weight_decay
-        self.m = None
-        self.v = None
+        self.ms = {}
+        self.vs = {}
+        self.bufs = {}  # scratch arrays for the update term
         self.t = 0
 
-    def step(self, params, grads):
-        if self.m is None:
-            self.m, self.v = {}, {}
-            for key, val in params.items():
-                self.m[key] = np.zeros_like(val)
-                self.v[key] = np.zeros_like(val)
-
+    def update(self):
         self.t += 1
+        super().update()
+
+    @property
+    def lr_t(self):
+        # bias corrections of m and v folded into a single scalar
+        fix1 = 1.0 - self.beta1**self.t
+        fix2 = 1.0 - self.beta2**self.t
+        return self.lr * math.sqrt(fix2) / fix1
+
+    def init_state(self, param):
+        xp = cuda.get_array_module(param.data)
+        key = id(param)
+        self.ms[key] = xp.zeros_like(param.data)
+        self.vs[key] = xp.zeros_like(param.data)
+        self.bufs[key] = xp.empty_like(param.data)
+
+    def drop_state(self, param):
+        key = id(param)
+        for state in (self.ms, self.vs, self.bufs):
+            state.pop(key, None)
 
-        for key in params.keys():
-            if self.decay != 0:
-                grads[key] += self.decay * params[key]
-
-            self.m[key] = self.beta1 * self.m[key] + (1 - self.beta1) * grads[key]
-            self.v[key] = self.beta2 * self.v[key] + (1 - self.beta2) * grads[key] ** 2
-
-            m_hat = self.m[key] / (1 - self.beta1**self.t)
-            v_hat = self.v[key] / (1 - self.beta2**self.t)
-
-            params[key] -= (self.lr / (np.sqrt(v_hat) + 1e-7)) * m_hat
+    def step(self, param):
+        xp = cuda.get_array_module(param.data)
+        key = id(param)
+        try:
+            m, v, buf = self.ms[key], self.vs[key], self.bufs[key]
+        except KeyError:  # param was initialized after setup()
+            self.init_state(param)
+            m, v, buf = self.ms[key], self.vs[key], self.bufs[key]
+
+        grad = param.grad.data
+        if self.decay != 0:
+            grad = grad + self.decay * param.data
+
+        m *= self.beta1
+        m += (1 - self.beta1) * grad
+        v *= self.beta2
+        v += (1 - self.beta2) * (grad * grad)
+
+        xp.sqrt(v, out=buf)
+        buf += self.eps
+        xp.divide(m, buf, out=buf)
+        buf *= self.lr_t
+        param.data -= buf
@@ -1,3 +1,4 @@
+import functools
 import os
 import subprocess
 import urllib.request
@@ -8,13 +9,22 @@ from mytorch import as_variable
 # =============================================================================
 # Utility functions for numpy
 # =============================================================================
-def sum_to(x, shape):
-    lead = x.ndim - len(shape)
+@functools.lru_cache(maxsize=None)
+def _sum_to_axis(x_shape, shape):
+    # axis argument of x.sum() that reduces x_shape to shape
+    if all(sx == 1 for sx in shape):
+        return None  # e.g. scalar-like bias gradient
+
+    lead = len(x_shape) - len(shape)
     lead_axis = tuple(range(lead))
     axis = tuple([i + lead for i, sx in enumerate(shape) if sx == 1])
-    y = x.sum(lead_axis + axis, keepdims=True)
-    if lead > 0:
-        y = y.squeeze(lead_axis)
+    return lead_axis + axis
+
+
+def sum_to(x, shape):
+    shape = tuple(shape)
+    axis = _sum_to_axis(x.shape, shape)
+    y = x.sum(axis).reshape(shape)  # single reduction, no squeeze
     return y
 
 
@@ -0,0 +1,44 @@
+import unittest
+import numpy as np
+
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+from mytorch import Variable, checkpoint
+import mytorch.functions as F
+import mytorch.layers as L
+
+
+class CheckpointTest(unittest.TestCase):
+    def test_same_gradients(self):
+        l1, l2 = L.Linear(5), L.Linear(3)
+
+        def block(x):
+            return F.tanh(l2(F.sigmoid(l1(x))))
+
+        x = np.random.randn(4, 6)
+        x0 = Variable(x)
+        y0 = F.sum(block(x0) ** 2)
+        y0.backward()
+        W_grad = l1.W.grad.data.copy()
+
+        l1.cleargrads()
+        l2.cleargrads()
+        x1 = Variable(x)
+        y1 = F.sum(checkpoint(block, x1) ** 2)
+        y1.backward()
+
+        self.assertTrue(np.allclose(y0.data, y1.data))
+        self.assertTrue(np.allclose(x0.grad.data, x1.grad.data))
+        self.assertTrue(np.allclose(W_grad, l1.W.grad.data))
+
+    def test_multiple_outputs(self):
+        x = Variable(np.random.randn(3))
+        a, b = checkpoint(lambda t: (t * 2, F.sin(t)), x)
+        F.sum(a * b).backward()
+        expected = 2 * np.sin(x.data) + 2 * x.data * np.cos(x.data)
+        self.assertTrue(np.allclose(x.grad.data, expected))
+
+
+unittest.main()
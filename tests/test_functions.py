@@ -0,0 +1,247 @@
+import unittest
+import gc
+import threading
+import weakref
+import numpy as np
+
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+from mytorch import Variable, using_config, _kernels
+import mytorch.functions as F
+import mytorch.layers as L
+
+
+class MSETest(unittest.TestCase):
+    def test_backward(self):
+        x = Variable(np.array([1.0, 2.0, 3.0]))
+        F.mse(x, np.zeros(3)).backward()
+        self.assertTrue(np.allclose(x.grad.data, 2 * x.data / 3))
+
+    def test_double_backprop(self):
+        x = Variable(np.array([1.0, 2.0, 3.0]))
+        F.mse(x, np.zeros(3)).backward(create_graph=True)
+        gx = x.grad
+        x.cleargrad()
+        F.sum(gx).backward()
+        self.assertTrue(np.allclose(x.grad.data, 2 / 3))
+
+
+class PowTest(unittest.TestCase):
+    def test_forward_backward(self):
+        for shape in ((), (3, 4)):
+            x = np.array(np.random.rand(*shape) + 0.5)
+            for c in (2, 3, 8, 1.5):
+                v = Variable(x)
+                y = v**c
+                self.assertEqual(y.shape, shape)
+                self.assertTrue(np.allclose(y.data, v.data**c))
+                F.sum(y).backward()
+                self.assertTrue(np.allclose(v.grad.data, c * v.data ** (c - 1)))
+
+    def test_double_backprop(self):
+        x = Variable(np.array(2.0))
+        y = x**2
+        y.backward(create_graph=True)
+        gx = x.grad
+        x.cleargrad()
+        gx.backward()
+        self.assertTrue(np.allclose(x.grad.data, 2.0))
+
+
+class SoftmaxTest(unittest.TestCase):
+    def test_forward(self):
+        x = np.array([[1.0, 2.0, 3.0], [1000.0, 1001.0, 1002.0]])
+        y = F.softmax(Variable(x))
+        e = np.exp([0.0, 1.0, 2.0])
+        self.assertTrue(np.allclose(y.data, e / e.sum()))
+
+    def test_integer_input(self):
+        y = F.softmax(Variable(np.array([[1, 2, 3]])))
+        e = np.exp([1.0, 2.0, 3.0])
+        self.assertEqual(y.dtype.kind, "f")
+        self.assertTrue(np.allclose(y.data, e / e.sum()))
+
+
+class ActivationLargeTest(unittest.TestCase):
+    # at least _kernels.min_size elements, so the compiled kernels are used
+    def setUp(self):
+        self.x = np.random.randn(4, _kernels.min_size).astype(np.float32)
+        self.x[0, :3] = [np.nan, np.inf, -np.inf]
+
+    def test_forward(self):
+        x = self.x
+        with np.errstate(over="ignore", invalid="ignore"):
+            expected = {
+                F.sigmoid: 1 / (1 + np.exp(-x)),
+                F.tanh: np.tanh(x),
+                F.relu: np.maximum(x, 0),
+            }
+        for f, y in expected.items():
+            self.assertTrue(np.allclose(f(Variable(x)).data, y, equal_nan=True))
+
+    def test_relu_backward(self):
+        x = Variable(self.x)
+        F.relu(x).backward()
+        self.assertTrue(np.array_equal(x.grad.data, (self.x > 0).astype(np.float32)))
+
+
+class ActivationBackwardTest(unittest.TestCase):
+    def check(self, x):
+        grads = {
+            F.sigmoid: lambda y: y * (1 - y),
+            F.tanh: lambda y: 1 - y * y,
+        }
+        for f, grad in grads.items():
+            v = Variable(x)
+            y = f(v)
+            y.backward()
+            self.assertEqual(v.grad.shape, x.shape)
+            self.assertTrue(np.allclose(v.grad.data, grad(y.data), atol=1e-6))
+
+    def test_scalar(self):
+        self.check(np.array(1.0))
+
+    def test_large(self):
+        # at least _kernels.min_size elements, so numexpr is used if available
+        self.check(np.random.randn(_kernels.min_size + 1))
+
+    def test_double_backprop_scalar(self):
+        x = Variable(np.array(1.0))
+        F.tanh(x).backward(create_graph=True)
+        gx = x.grad
+        x.cleargrad()
+        gx.backward()
+        y = np.tanh(1.0)
+        self.assertTrue(np.allclose(x.grad.data, -2 * y * (1 - y * y)))
+
+
+class ReLUPackedMaskTest(unittest.TestCase):
+    def setUp(self):
+        self.threshold = F.ReLU.pack_threshold
+        F.ReLU.pack_threshold = 10  # pack the 3x7 test input
+
+    def tearDown(self):
+        F.ReLU.pack_threshold = self.threshold
+
+    def test_backward(self):
+        for create_graph in (False, True):
+            x = Variable(np.random.randn(3, 7))
+            y = F.relu(x)
+            self.assertIsNone(y.creator.mask)
+            self.assertTrue(np.allclose(y.data, np.maximum(x.data, 0)))
+            F.sum(y * 3).backward(create_graph=create_graph)
+            expected = 3 * (x.data > 0)
+            self.assertTrue(np.array_equal(x.grad.data, expected))
+
+    def test_small_mask_not_packed(self):
+        y = F.relu(Variable(np.random.randn(2, 3)))
+        self.assertEqual(y.creator.mask.dtype, bool)
+
+
+class LinearReuseOutTest(unittest.TestCase):
+    def test_buffer_reuse(self):
+        layer = L.Linear(3, in_size=4, reuse_out=True)
+        x = np.random.randn(5, 4).astype(np.float32)
+
+        y0 = layer(x)
+        buf = y0.data
+        y1 = layer(x * 2)
+        self.assertIs(y1.data, buf)  # same shape and dtype
+        expected = (x * 2) @ layer.W.data + layer.b.data
+        self.assertTrue(np.allclose(y1.data, expected, atol=1e-5))
+
+        y2 = layer(x[:2])
+        self.assertIsNot(y2.data, buf)  # batch shape changed
+        self.assertEqual(y2.shape, (2, 3))
+
+        with using_config("default_dtype", None):
+            y3 = layer(x[:2].astype(np.float64))
+        self.assertIsNot(y3.data, y2.data)  # dtype changed
+        self.assertEqual(y3.dtype, np.float64)
+
+    def test_same_gradients(self):
+        layer = L.Linear(3, in_size=4, reuse_out=True)
+        x = np.random.randn(5, 4).astype(np.float32)
+        grads = []
+        for reuse_out in (False, True):
+            layer.reuse_out = reuse_out
+            layer.cleargrads()
+            v = Variable(x)
+            for _ in range(2):  # second call reuses the buffer
+                y = F.sum(F.sigmoid(layer(v)))
+            y.backward()
+            grads.append((v.grad.data, layer.W.grad.data, layer.b.grad.data))
+
+        for g0, g1 in zip(*grads):
+            self.assertTrue(np.allclose(g0, g1))
+
+
+class BroadcastGradTest(unittest.TestCase):
+    def test_one_side_broadcast(self):
+        x0 = Variable(np.random.randn(3, 4))
+        x1 = Variable(np.random.randn(4))
+        for y in (x0 + x1, x0 - x1, x0 * x1, x0 / x1):
+            x0.cleargrad()
+            x1.cleargrad()
+            F.sum(y).backward()
+            self.assertEqual(x0.grad.shape, (3, 4))
+            self.assertEqual(x1.grad.shape, (4,))
+
+        x0.cleargrad()
+        x1.cleargrad()
+        F.sum(x0 * x1).backward()
+        self.assertTrue(np.allclose(x0.grad.data, np.broadcast_to(x1.data, (3, 4))))
+        self.assertTrue(np.allclose(x1.grad.data, x0.data.sum(axis=0)))
+
+    def test_transpose_1d(self):
+        x = np.arange(3.0)
+        self.assertTrue(np.array_equal(F.transpose(x).data, x))
+        v = Variable(x)
+        self.assertIs(F.transpose(v), v)
+
+
+class GraphMemoryTest(unittest.TestCase):
+    def test_freed_without_backward(self):
+        gc.disable()
+        try:
+            h = F.tanh(F.sigmoid(Variable(np.random.randn(100, 100))))
+            ref = weakref.ref(h)
+            del h
+            self.assertIsNone(ref())  # freed by refcount, no reference cycle
+        finally:
+            gc.enable()
+
+
+class CrossThreadBackwardTest(unittest.TestCase):
+    def test_backward_in_other_thread(self):
+        x = Variable(np.array(2.0))
+        y = x * x
+        t = threading.Thread(target=y.backward)
+        t.start()
+        t.join()
+        self.assertEqual(x.grad.data, 4.0)
+
+    def test_forward_in_other_thread(self):
+        x = Variable(np.array(3.0))
+        out = []
+        t = threading.Thread(target=lambda: out.append(F.sigmoid(x * x) + x))
+        t.start()
+        t.join()
+        y = out[0]
+        y.backward()
+        s = 1 / (1 + np.exp(-9.0))
+        self.assertAlmostEqual(float(x.grad.data), s * (1 - s) * 6 + 1, places=5)
+
+    def test_freed_graph_raises(self):
+        x = Variable(np.array(2.0))
+        with using_config("strong_outputs", True):
+            y = x * x
+        y.backward()  # frees the graph
+        y.grad = None
+        with self.assertRaises(RuntimeError):
+            y.backward()
+
+
+unittest.main()
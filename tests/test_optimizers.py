@@ -0,0 +1,114 @@
+import unittest
+import numpy as np
+
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+from mytorch import Variable, Parameter, Layer
+import mytorch.functions as F
+import mytorch.layers as L
+from mytorch.optimizers import SGD, MomentumSGD, Adam
+
+
+class Quadratic(Layer):
+    def __init__(self):
+        super().__init__()
+        self.w = Parameter(np.array([3.0, -2.0]), name="w")
+
+    def forward(self):
+        return (self.w * self.w).sum()
+
+
+class TwoParams(Layer):
+    def __init__(self):
+        super().__init__()
+        self.w = Parameter(np.array([[3.0, -2.0], [1.0, 0.5]]), name="w")
+        self.b = Parameter(np.array([-1.0, 4.0]), name="b")
+
+    def forward(self):
+        return (self.w * self.w).sum() + (self.b * self.b * 2).sum()
+
+
+def train(optimizer, iters, model=None, flat=False):
+    if model is None:
+        model = Quadratic()
+    optimizer.setup(model, flat=flat)
+    for _ in range(iters):
+        model.cleargrads()
+        loss = model()
+        loss.backward()
+        optimizer.update()
+    return model.w.data
+
+
+class OptimizerTest(unittest.TestCase):
+    def test_sgd(self):
+        w = train(SGD(lr=0.1), 100)
+        self.assertTrue(np.allclose(w, 0.0, atol=1e-6))
+
+    def test_momentum_sgd_keeps_velocity(self):
+        optimizer = MomentumSGD(lr=0.1, momentum=0.9)
+        train(optimizer, 2)
+        # v1 = -lr * g0, v2 = momentum * v1 - lr * g1
+        g0 = 2 * np.array([3.0, -2.0])
+        w1 = np.array([3.0, -2.0]) - 0.1 * g0
+        expected = 0.9 * (-0.1 * g0) - 0.1 * (2 * w1)
+        (v,) = optimizer.vs.values()
+        self.assertTrue(np.allclose(v, expected))
+
+    def test_momentum_sgd(self):
+        w = train(MomentumSGD(lr=0.01, momentum=0.9), 300)
+        self.assertTrue(np.allclose(w, 0.0, atol=1e-3))
+
+    def test_adam(self):
+        w = train(Adam(lr=0.1), 500)
+        self.assertTrue(np.allclose(w, 0.0, atol=1e-2))
+
+    def test_flat_matches_per_param(self):
+        for make in (lambda: SGD(lr=0.1), lambda: MomentumSGD(lr=0.05), Adam):
+            model, flat_model = TwoParams(), TwoParams()
+            train(make(), 20, model)
+            optimizer = make()
+            train(optimizer, 20, flat_model, flat=True)
+
+            self.assertTrue(np.allclose(model.w.data, flat_model.w.data))
+            self.assertTrue(np.allclose(model.b.data, flat_model.b.data))
+            self.assertIs(flat_model.w.data.base, optimizer.flat_param.data)
+
+    def test_flat_float64(self):
+        layer = L.Linear(3, dtype=np.float64, in_size=4)
+        self.assertEqual(layer.b.dtype, np.float64)
+        W0 = layer.W.data.copy()
+
+        optimizer = SGD(lr=0.1).setup(layer, flat=True)
+        x = np.random.randn(2, 4)
+        for _ in range(2):
+            layer.cleargrads()
+            F.sum(layer(x) ** 2).backward()
+            optimizer.update()
+
+        self.assertEqual(optimizer.flat_param.dtype, np.float64)
+        self.assertIs(layer.W.data.base, optimizer.flat_param.data)
+        self.assertFalse(np.allclose(layer.W.data, W0))
+
+    def test_flat_lazy_param(self):
+        model = Layer()
+        model.l0 = L.Linear(3)
+        model.l1 = L.Linear(2)  # not used until later, W stays None
+        optimizer = SGD(lr=0.1).setup(model, flat=True)
+        x = np.random.randn(4, 5)
+
+        model.cleargrads()
+        F.sum(model.l0(x)).backward()
+        optimizer.update()
+        self.assertIsNone(model.l1.W.data)
+
+        model.cleargrads()
+        F.sum(model.l1(model.l0(x))).backward()
+        optimizer.update()  # l1.W is materialized now, so params are flattened again
+        self.assertIs(model.l1.W.data.base, optimizer.flat_param.data)
+        self.assertIs(model.l0.W.data.base, optimizer.flat_param.data)
+
+
+unittest.main()